@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Fold image preprocessing into the YOLOv5n ONNX model so it takes raw uint8 frames
+"""
+
+import os
+import sys
+from pathlib import Path
+
+# (source, output) pairs. The INT8 model is only used as the source when opted
+# in, as in the server, and its fused copy gets its own name so the server never
+# picks it up once USE_INT8_MODEL is unset
+MODEL_PATHS = [(Path("models/yolov5n.onnx"), Path("models/yolov5n.uint8.onnx"))]
+if os.getenv('USE_INT8_MODEL', 'false').lower() == 'true':
+    MODEL_PATHS.insert(0, (Path("models/yolov5n.int8.onnx"), Path("models/yolov5n.int8.uint8.onnx")))
+
+def fuse_preprocessing(model):
+    """
+    Replace the float NCHW input with a uint8 NHWC BGR input
+    
+    Prepends Gather (BGR->RGB), Cast, Mul (1/255) and Transpose (NHWC->NCHW)
+    so the server can feed its resized frame buffer directly.
+    """
+    import numpy as np
+    from onnx import TensorProto, helper, numpy_helper
+    
+    original_input = model.graph.input[0]
+    input_name = original_input.name
+    
+    # The quantizer already derives names like "images_scale" from the input
+    # name, so the new tensors get their own prefix and are checked for clashes
+    prefix = f"{input_name}_preproc"
+    names = {
+        step: f"{prefix}_{step}" for step in ("bgr_to_rgb", "scale", "rgb", "float", "scaled", "nchw")
+    }
+    existing = {name for node in model.graph.node for name in (*node.input, *node.output, node.name)}
+    existing.update(initializer.name for initializer in model.graph.initializer)
+    existing.update(value.name for value in model.graph.value_info)
+    clashes = existing.intersection(names.values())
+    if clashes:
+        raise ValueError(f"Model already has tensors named {sorted(clashes)}")
+    nchw_name = names["nchw"]
+    elem_type = original_input.type.tensor_type.elem_type
+    batch, channels, height, width = original_input.type.tensor_type.shape.dim
+    
+    # Existing nodes now read the tensor produced by the prepended nodes
+    for node in model.graph.node:
+        for i, name in enumerate(node.input):
+            if name == input_name:
+                node.input[i] = nchw_name
+    
+    scale_dtype = helper.tensor_dtype_to_np_dtype(elem_type)
+    model.graph.initializer.extend([
+        numpy_helper.from_array(np.array([2, 1, 0], dtype=np.int64), names["bgr_to_rgb"]),
+        numpy_helper.from_array(np.array(1 / 255.0, dtype=scale_dtype), names["scale"]),
+    ])
+    
+    preprocessing = [
+        helper.make_node("Gather", [input_name, names["bgr_to_rgb"]], [names["rgb"]], axis=3),
+        helper.make_node("Cast", [names["rgb"]], [names["float"]], to=elem_type),
+        helper.make_node("Mul", [names["float"], names["scale"]], [names["scaled"]]),
+        helper.make_node("Transpose", [names["scaled"]], [nchw_name], perm=[0, 3, 1, 2]),
+    ]
+    for node in reversed(preprocessing):
+        model.graph.node.insert(0, node)
+    
+    new_input = helper.make_tensor_value_info(
+        input_name, TensorProto.UINT8,
+        [dim.dim_param or dim.dim_value for dim in (batch, height, width, channels)]
+    )
+    model.graph.input.remove(original_input)
+    model.graph.input.insert(0, new_input)
+    
+    return model
+
+def export_uint8_model():
+    """Write models/yolov5n.uint8.onnx from the FP model (or models/yolov5n.int8.uint8.onnx from the INT8 model when USE_INT8_MODEL=true)"""
+    try:
+        import onnx
+    except ImportError:
+        print("❌ ONNX library not available")
+        print("💡 Install with: pip install onnx")
+        return False
+    
+    source_path, output_path = next(
+        ((source, output) for source, output in MODEL_PATHS if source.exists()), (None, None)
+    )
+    if source_path is None:
+        print(f"❌ Model not found: {MODEL_PATHS[-1][0]}")
+        return False
+    
+    try:
+        print(f"🔧 Fusing preprocessing into {source_path}...")
+        model = fuse_preprocessing(onnx.load(str(source_path)))
+        onnx.checker.check_model(model)
+        onnx.save(model, str(output_path))
+        print(f"✅ uint8-input model written to {output_path}")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Export failed: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🧩 YOLOv5n Preprocessing Fuser")
+    print("==============================")
+    
+    if not export_uint8_model():
+        sys.exit(1)
+    
+    print("\n💡 Server mode will now feed raw uint8 frames to this model automatically.")
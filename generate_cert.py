@@ -36,17 +36,22 @@ def generate_python_cert():
         from cryptography import x509
         from cryptography.x509.oid import NameOID
         from cryptography.hazmat.primitives import hashes, serialization
-        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.hazmat.primitives.asymmetric import ec
         import datetime
         import ipaddress
+        import secrets
+        
+        from cryptography.hazmat.backends.openssl.backend import backend
         
         print("🔧 Generating certificate with Python cryptography...")
+        # Key generation speed depends on the OpenSSL build the wheel links
+        # against (asm-enabled OpenSSL 3.x with cryptography>=42)
+        print(f"   Using {backend.openssl_version_text()}")
         
-        # Generate private key
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-        )
+        # Generate private key - ECDSA P-256 is generated almost instantly, unlike
+        # RSA-2048's prime search, and is accepted by every browser for TLS
+        # (Ed25519 server certificates are not)
+        private_key = ec.generate_private_key(ec.SECP256R1())
         
         # Certificate details
         subject = issuer = x509.Name([
@@ -65,7 +70,8 @@ def generate_python_cert():
         ).public_key(
             private_key.public_key()
         ).serial_number(
-            x509.random_serial_number()
+            # Positive, non-zero and at most 20 octets, drawn from getrandom(2)
+            secrets.randbits(159) | 1
         ).not_valid_before(
             datetime.datetime.utcnow()
         ).not_valid_after(
@@ -96,7 +102,7 @@ def generate_python_cert():
         
     except ImportError:
         print("❌ Python cryptography library not available")
-        print("💡 Install with: pip install cryptography")
+        print("💡 Install with: pip install \"cryptography>=42.0.4\"")
         return False
     except Exception as e:
         print(f"❌ Python cert generation failed: {e}")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Quantize the YOLOv5n ONNX model to INT8 for faster CPU inference
+"""
+
+import sys
+from pathlib import Path
+
+MODEL_PATH = Path("models/yolov5n.onnx")
+FP32_MODEL_PATH = Path("models/yolov5n.fp32.onnx")
+INT8_MODEL_PATH = Path("models/yolov5n.int8.onnx")
+
+def convert_to_float32(model):
+    """Upcast a float16 export to float32 so it can be quantized"""
+    from onnx import TensorProto, numpy_helper
+    import numpy as np
+    
+    for initializer in model.graph.initializer:
+        if initializer.data_type == TensorProto.FLOAT16:
+            array = numpy_helper.to_array(initializer).astype(np.float32)
+            initializer.CopyFrom(numpy_helper.from_array(array, initializer.name))
+    
+    for node in model.graph.node:
+        for attr in node.attribute:
+            if node.op_type == "Constant" and attr.t.data_type == TensorProto.FLOAT16:
+                attr.t.CopyFrom(numpy_helper.from_array(numpy_helper.to_array(attr.t).astype(np.float32)))
+            elif node.op_type == "Cast" and attr.name == "to" and attr.i == TensorProto.FLOAT16:
+                attr.i = TensorProto.FLOAT
+    
+    for value in list(model.graph.input) + list(model.graph.output) + list(model.graph.value_info):
+        if value.type.tensor_type.elem_type == TensorProto.FLOAT16:
+            value.type.tensor_type.elem_type = TensorProto.FLOAT
+    
+    return model
+
+def quantize_model():
+    """Quantize model weights to INT8 using ONNX Runtime dynamic quantization"""
+    try:
+        import onnx
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError:
+        print("❌ ONNX Runtime quantization tools not available")
+        print("💡 Install with: pip install onnxruntime onnx")
+        return False
+    
+    if not MODEL_PATH.exists():
+        print(f"❌ Model not found: {MODEL_PATH}")
+        return False
+    
+    try:
+        # Dynamic quantization only accepts float32 graphs; the released
+        # YOLOv5n export is float16
+        print(f"🔧 Converting {MODEL_PATH} to float32...")
+        onnx.save(convert_to_float32(onnx.load(str(MODEL_PATH))), str(FP32_MODEL_PATH))
+        
+        print(f"🔧 Quantizing {FP32_MODEL_PATH} to INT8...")
+        quantize_dynamic(str(FP32_MODEL_PATH), str(INT8_MODEL_PATH), weight_type=QuantType.QInt8)
+        
+        fp32_mb = FP32_MODEL_PATH.stat().st_size / (1024 * 1024)
+        int8_mb = INT8_MODEL_PATH.stat().st_size / (1024 * 1024)
+        print(f"✅ INT8 model written to {INT8_MODEL_PATH} ({fp32_mb:.1f} MB -> {int8_mb:.1f} MB)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Quantization failed: {e}")
+        return False
+    finally:
+        FP32_MODEL_PATH.unlink(missing_ok=True)
+
+if __name__ == "__main__":
+    print("🧮 YOLOv5n INT8 Quantizer")
+    print("=========================")
+    
+    if not quantize_model():
+        sys.exit(1)
+    
+    print("\n💡 Set USE_INT8_MODEL=true to have server mode load the INT8 model.")
+    print("   Benchmark it first - dynamic INT8 is often slower than the float model on CPU.")
@@ -4,18 +4,24 @@ Supports both server-side ONNX inference and WASM client-side mode
 """
 
 import asyncio
-import base64
-import io
+import concurrent.futures
 import logging
+import multiprocessing
+import os
 import time
 from pathlib import Path
 
 import cv2
 import numpy as np
-from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# Prefer the SIMD-accelerated base64 decoder; the stdlib API is identical
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 # Try to import ONNX Runtime with fallback handling
 try:
     import onnxruntime as ort
@@ -25,13 +31,134 @@ except ImportError as e:
     ONNX_AVAILABLE = False
     ort = None
 
+# Numba is optional; without it post-processing uses the vectorized NumPy path
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    numba = None
+
+def _decode_candidates_vectorized(candidates, conf_threshold, inv_w, inv_h):
+    """
+    Score candidate rows and convert their boxes to normalized corners
+    Args:
+        candidates: float32 [N, 85] YOLO rows that passed the objectness filter
+        conf_threshold: Minimum objectness * class confidence
+        inv_w, inv_h: Reciprocal of the model input width/height
+    Returns:
+        (corners [M, 4], scores [M], class_ids [M]) for the boxes that survive
+    """
+    # Get class with highest score for every row
+    class_scores = candidates[:, 5:]
+    class_ids = class_scores.argmax(axis=1)
+    class_confidence = class_scores[np.arange(len(class_scores)), class_ids]
+    
+    # Final confidence
+    scores = candidates[:, 4] * class_confidence
+    keep = scores >= conf_threshold
+    candidates, class_ids, scores = candidates[keep], class_ids[keep], scores[keep]
+    
+    # Convert from center format to corner format normalized to [0, 1]
+    x_center, y_center = candidates[:, 0], candidates[:, 1]
+    half_w, half_h = candidates[:, 2] / 2, candidates[:, 3] / 2
+    corners = np.stack([
+        (x_center - half_w) * inv_w,
+        (y_center - half_h) * inv_h,
+        (x_center + half_w) * inv_w,
+        (y_center + half_h) * inv_h,
+    ], axis=1)
+    np.clip(corners, 0, 1, out=corners)
+    
+    # Skip invalid boxes
+    valid = (corners[:, 2] > corners[:, 0]) & (corners[:, 3] > corners[:, 1])
+    return corners[valid], scores[valid], class_ids[valid]
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True, fastmath=True)
+    def _decode_candidates(candidates, conf_threshold, inv_w, inv_h):
+        """Row-by-row JIT-compiled equivalent of _decode_candidates_vectorized"""
+        num_rows, num_cols = candidates.shape
+        corners = np.empty((num_rows, 4), dtype=np.float32)
+        scores = np.empty(num_rows, dtype=np.float32)
+        class_ids = np.empty(num_rows, dtype=np.int64)
+        count = 0
+        
+        for i in range(num_rows):
+            # Get class with highest score
+            class_id = 0
+            class_confidence = candidates[i, 5]
+            for j in range(6, num_cols):
+                if candidates[i, j] > class_confidence:
+                    class_confidence = candidates[i, j]
+                    class_id = j - 5
+            
+            # Final confidence
+            score = candidates[i, 4] * class_confidence
+            if score < conf_threshold:
+                continue
+            
+            # Convert from center format to corner format normalized to [0, 1]
+            half_w = candidates[i, 2] / 2
+            half_h = candidates[i, 3] / 2
+            xmin = min(max((candidates[i, 0] - half_w) * inv_w, 0.0), 1.0)
+            ymin = min(max((candidates[i, 1] - half_h) * inv_h, 0.0), 1.0)
+            xmax = min(max((candidates[i, 0] + half_w) * inv_w, 0.0), 1.0)
+            ymax = min(max((candidates[i, 1] + half_h) * inv_h, 0.0), 1.0)
+            
+            # Skip invalid boxes
+            if xmax <= xmin or ymax <= ymin:
+                continue
+            
+            corners[count, 0] = xmin
+            corners[count, 1] = ymin
+            corners[count, 2] = xmax
+            corners[count, 3] = ymax
+            scores[count] = score
+            class_ids[count] = class_id
+            count += 1
+        
+        return corners[:count], scores[:count], class_ids[:count]
+else:
+    _decode_candidates = _decode_candidates_vectorized
+
+# Engine owned by each inference worker process (see InferenceEngine.processes)
+_worker_engine = None
+
+def _worker_init(mode):
+    """Load the model once in an inference worker process"""
+    global _worker_engine
+    _worker_engine = InferenceEngine(mode=mode, processes=0)
+
+def _worker_detect(image_data):
+    """Decode one frame and run it through the worker's engine"""
+    if _worker_engine.session is None:
+        return []
+    return _worker_engine._run_batch([_worker_engine._decode_image(image_data)])[0]
+
 class InferenceEngine:
-    def __init__(self, mode="wasm"):
+    def __init__(self, mode="wasm", processes=None):
         self.mode = mode.lower()
         self.session = None
         self.input_size = (320, 240)  # Low-resource default
         self.confidence_threshold = 0.5
         self.nms_threshold = 0.4
+        self.max_nms_candidates = 300  # Bounds NMS work on noisy frames
+        
+        # Frame batching: frames arriving within batch_timeout of each other are
+        # coalesced into one inference call (needs a model with a dynamic batch dim)
+        self.max_batch_size = 8
+        self.batch_timeout = 0.005
+        self._batch_queue = None
+        self._batch_task = None
+        self._bound_batch_size = 0
+        
+        # Decoding and inference run here so they don't block the event loop.
+        # cv2.imdecode and ORT both release the GIL, so frames from different
+        # clients decode in parallel on all cores while a batch runs
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(2, os.cpu_count() or 1), thread_name_prefix="inference"
+        )
         
         # COCO class names (YOLOv5 default)
         self.class_names = [
@@ -49,7 +176,25 @@ class InferenceEngine:
             'toothbrush'
         ]
         
-        if self.mode == "server":
+        # INFERENCE_PROCESSES > 0 runs decode and inference in that many worker
+        # processes, each with its own model, so Python-level pre/post-processing
+        # of different clients isn't serialized on the GIL. Frames are then not batched
+        if processes is None:
+            processes = int(os.getenv('INFERENCE_PROCESSES', '0'))
+        self.processes = processes
+        self._process_pool = None
+        self._closed = False
+        
+        if self.mode == "server" and ONNX_AVAILABLE and self.processes > 0:
+            # spawn: forking a process that already runs threads is unsafe
+            self._process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_worker_init,
+                initargs=(self.mode,)
+            )
+            logger.info(f"🧵 Running inference in {self.processes} worker processes")
+        elif self.mode == "server":
             self._initialize_onnx_session()
         
         logger.info(f"🧠 Inference engine initialized in {mode.upper()} mode")
@@ -61,16 +206,49 @@ class InferenceEngine:
             return
             
         try:
-            model_path = Path("models/yolov5n.onnx")
-            if not model_path.exists():
+            # Prefer the models produced by fuse_preprocessing.py and
+            # quantize_model.py when present. The INT8 models are opt-in: dynamic
+            # quantization turns the convolutions into ConvInteger ops, which run
+            # several times slower than the float model on the CPUs measured so far
+            use_int8 = os.getenv('USE_INT8_MODEL', 'false').lower() == 'true'
+            int8_paths = (Path("models/yolov5n.int8.uint8.onnx"), Path("models/yolov5n.int8.onnx"))
+            for model_path in (
+                *(int8_paths if use_int8 else ()),
+                Path("models/yolov5n.uint8.onnx"),
+                Path("models/yolov5n.onnx")
+            ):
+                if model_path.exists():
+                    break
+            else:
                 raise FileNotFoundError(f"Model not found: {model_path}")
             
-            # Configure ONNX Runtime for CPU optimization
-            providers = ['CPUExecutionProvider']
+            # Configure ONNX Runtime for CPU optimization, preferring the oneDNN-based
+            # providers when this onnxruntime build ships them
+            available = set(ort.get_available_providers())
+            providers = [
+                provider for provider in (
+                    ('OpenVINOExecutionProvider', {'device_type': 'CPU_FP32'}),
+                    'DnnlExecutionProvider',
+                    'CPUExecutionProvider'
+                )
+                if (provider[0] if isinstance(provider, tuple) else provider) in available
+            ]
             sess_options = ort.SessionOptions()
             sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
             sess_options.intra_op_num_threads = 4
             
+            # Reuse the allocation plan across same-shape frames
+            sess_options.enable_mem_pattern = True
+            sess_options.enable_cpu_mem_arena = True
+            
+            # YOLOv5n is an almost purely sequential graph, and parallel execution
+            # measured slower; ORT_PARALLEL=true opts in for benchmarking other setups
+            if os.getenv('ORT_PARALLEL', 'false').lower() == 'true':
+                sess_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+                sess_options.inter_op_num_threads = 2
+            else:
+                sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            
             self.session = ort.InferenceSession(
                 str(model_path), 
                 sess_options=sess_options,
@@ -80,190 +258,282 @@ class InferenceEngine:
             # Get model input details
             input_details = self.session.get_inputs()[0]
             input_shape = input_details.shape
+            self._input_name = input_details.name
+            self._output_names = [output.name for output in self.session.get_outputs()]
+            
+            # Models from fuse_preprocessing.py take raw uint8 BGR frames as
+            # [batch, height, width, channels] and normalize them in-graph
+            self._uint8_input = input_details.type == 'tensor(uint8)'
             
             if len(input_shape) == 4:  # [batch, channels, height, width]
-                self.input_size = (input_shape[3], input_shape[2])  # (width, height)
+                if self._uint8_input:
+                    self.input_size = (input_shape[2], input_shape[1])  # (width, height)
+                else:
+                    self.input_size = (input_shape[3], input_shape[2])  # (width, height)
+                if isinstance(input_shape[0], int):
+                    # Static batch dimension - frames are run one at a time
+                    self.max_batch_size = 1
+            
+            # Persistent buffers: frames are resized and normalized in place, and the
+            # input tensor is bound once so ORT reads it without an extra copy
+            # (the exported YOLOv5n takes float16 input, so follow the model's type)
+            input_w, input_h = self.input_size
+            if self._uint8_input:
+                self._input_tensor = np.empty(
+                    (self.max_batch_size, input_h, input_w, 3), dtype=np.uint8
+                )
+            else:
+                input_dtype = np.float16 if input_details.type == 'tensor(float16)' else np.float32
+                self._resized = np.empty((input_h, input_w, 3), dtype=np.uint8)
+                self._input_tensor = np.empty(
+                    (self.max_batch_size, 3, input_h, input_w), dtype=input_dtype
+                )
+            self._io_binding = self.session.io_binding()
+            self._bind_input(1)
+            
+            # Warm up with a blank frame so kernel selection and memory planning
+            # happen now rather than on the first real frame
+            self._input_tensor[0] = 0
+            self.session.run_with_iobinding(self._io_binding)
             
             logger.info(f"✅ ONNX model loaded: {model_path}")
-            logger.info(f"📐 Input size: {self.input_size}")
+            logger.info(f"⚙️ Execution providers: {self.session.get_providers()}")
+            logger.info(f"📐 Input size: {self.input_size}, max batch: {self.max_batch_size}")
             
         except Exception as e:
             logger.error(f"❌ Failed to initialize ONNX session: {e}")
             logger.warning("🔄 Falling back to WASM mode")
             self.mode = "wasm"
+            return
+        
+        self._warm_up_decoder()
+
+    def _warm_up_decoder(self):
+        """Compile the Numba post-processing kernel now rather than on the first frame"""
+        global _decode_candidates
+        if not NUMBA_AVAILABLE or _decode_candidates is _decode_candidates_vectorized:
+            return
+        
+        try:
+            _decode_candidates(np.zeros((1, 85), dtype=np.float32), 1.0, 1.0, 1.0)
+        except Exception as e:
+            # Numba is only a speed-up; a stale or unreadable JIT cache must not
+            # take the loaded session down with it
+            logger.warning(f"⚠️ Numba decoder unavailable, using NumPy post-processing: {e}")
+            _decode_candidates = _decode_candidates_vectorized
 
     async def detect_objects(self, image_data):
         """
         Detect objects in image
         Args:
-            image_data: Base64 encoded image or numpy array
+            image_data: Base64 encoded image, encoded image bytes or numpy array
         Returns:
             List of detection dictionaries
         """
+        if self._process_pool is not None:
+            try:
+                # The payload is pickled to the worker as-is; decoding happens there too
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._process_pool, _worker_detect, image_data)
+            except Exception as e:
+                logger.error(f"❌ Detection error: {e}")
+                return []
+        
         if self.mode == "wasm" or not ONNX_AVAILABLE or self.session is None:
             # In WASM mode or when ONNX is not available, detection happens client-side
             return []
         
         try:
-            # Decode image
-            if isinstance(image_data, str):
-                # Base64 encoded image
-                image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
-                image = Image.open(io.BytesIO(image_bytes))
-                img_array = np.array(image)
-            elif isinstance(image_data, np.ndarray):
-                img_array = image_data
-            else:
-                raise ValueError("Unsupported image format")
-            
-            # Preprocess image
-            processed_img = self._preprocess_image(img_array)
-            
-            # Run inference
-            start_time = time.time()
-            outputs = self.session.run(None, {self.session.get_inputs()[0].name: processed_img})
-            inference_time = time.time() - start_time
-            
-            # Post-process detections
-            detections = self._postprocess_detections(outputs[0], img_array.shape)
+            loop = asyncio.get_running_loop()
+            img_array = await loop.run_in_executor(self._pool, self._decode_image, image_data)
             
-            logger.debug(f"🔍 Detected {len(detections)} objects in {inference_time:.3f}s")
+            # Hand the frame to the batching worker and wait for its detections
+            if self._batch_queue is None:
+                self._batch_queue = asyncio.Queue()
+                self._batch_task = asyncio.create_task(self._batch_worker())
             
-            return detections
+            future = loop.create_future()
+            await self._batch_queue.put((img_array, future))
+            return await future
             
         except Exception as e:
             logger.error(f"❌ Detection error: {e}")
             return []
 
-    def _preprocess_image(self, img_array):
-        """Preprocess image for YOLO model"""
-        # Convert BGR to RGB if needed
-        if img_array.shape[2] == 3:
-            img_rgb = cv2.cvtColor(img_array, cv2.COLOR_BGR2RGB)
+    def _decode_image(self, image_data):
+        """Decode a base64 string, encoded image bytes or pass through a numpy array"""
+        if isinstance(image_data, str):
+            # Base64 encoded image, optionally as a data URL. Only the short header
+            # is searched for the comma instead of scanning the whole payload
+            comma = image_data.find(',', 0, 64) if image_data.startswith('data:') else -1
+            if comma >= 0:
+                image_data = image_data[comma + 1:]
+            image_bytes = base64.b64decode(image_data, validate=False)
+        elif isinstance(image_data, (bytes, bytearray, memoryview)):
+            # Already-encoded JPEG/PNG bytes (binary transport), no base64 step
+            image_bytes = image_data
+        elif isinstance(image_data, np.ndarray):
+            return image_data
         else:
-            img_rgb = img_array
+            raise ValueError("Unsupported image format")
         
-        # Resize to model input size
-        img_resized = cv2.resize(img_rgb, self.input_size)
+        # np.frombuffer wraps the bytes without copying, imdecode goes straight to BGR
+        img_array = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img_array is None:
+            raise ValueError("Could not decode image")
+        return img_array
+
+    async def _batch_worker(self):
+        """Coalesce queued frames into batches and run one inference call per batch"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._batch_queue.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self._batch_queue.get(), self.batch_timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            images = [img_array for img_array, _ in batch]
+            try:
+                # Batches run one at a time, so the shared input buffers are never
+                # written by two threads at once
+                results = await loop.run_in_executor(self._pool, self._run_batch, images)
+            except asyncio.CancelledError:
+                # close() cancelled the worker; don't leave callers waiting on this batch
+                for _, future in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), detections in zip(batch, results):
+                if not future.done():
+                    future.set_result(detections)
+
+    def _run_batch(self, images):
+        """Run inference on a list of decoded frames, returning detections per frame"""
+        # Preprocess each frame into its slot of the bound input tensor
+        for index, img_array in enumerate(images):
+            self._preprocess_image(img_array, index)
+        self._bind_input(len(images))
         
-        # Normalize to [0, 1] and convert to float32
-        img_normalized = img_resized.astype(np.float32) / 255.0
+        # Run inference
+        start_time = time.time()
+        self.session.run_with_iobinding(self._io_binding)
+        outputs = self._io_binding.copy_outputs_to_cpu()
+        inference_time = time.time() - start_time
         
-        # Convert HWC to CHW format
-        img_transposed = np.transpose(img_normalized, (2, 0, 1))
+        # Post-process detections
+        results = [
+            self._postprocess_detections(outputs[0][index], img_array.shape)
+            for index, img_array in enumerate(images)
+        ]
         
-        # Add batch dimension
-        img_batch = np.expand_dims(img_transposed, axis=0)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"🔍 Detected {sum(len(d) for d in results)} objects in "
+                f"{len(images)} frame(s) in {inference_time:.3f}s"
+            )
         
-        return img_batch
+        return results
 
-    def _postprocess_detections(self, outputs, original_shape):
-        """Post-process YOLO outputs to get bounding boxes"""
-        detections = []
+    def _bind_input(self, batch_size):
+        """Bind the leading batch_size frames of the persistent input tensor"""
+        if batch_size == self._bound_batch_size:
+            return
         
-        # YOLO output format: [batch, num_detections, 85] 
-        # 85 = 4 bbox coords + 1 confidence + 80 class scores
-        if len(outputs.shape) == 3:
-            outputs = outputs[0]  # Remove batch dimension
+        self._io_binding.bind_input(
+            self._input_name, 'cpu', 0, self._input_tensor.dtype,
+            (batch_size,) + self._input_tensor.shape[1:], self._input_tensor.ctypes.data
+        )
         
-        orig_h, orig_w = original_shape[:2]
-        input_h, input_w = self.input_size[1], self.input_size[0]
+        # ORT keeps the output allocated by the previous run bound, which no
+        # longer matches once the batch size changes
+        self._io_binding.clear_binding_outputs()
+        for output_name in self._output_names:
+            self._io_binding.bind_output(output_name, 'cpu')
         
-        # Scale factors
-        scale_x = orig_w / input_w
-        scale_y = orig_h / input_h
+        self._bound_batch_size = batch_size
+
+    def _preprocess_image(self, img_array, index=0):
+        """Preprocess image for YOLO model into slot `index` of the input tensor"""
+        # Resize to model input size without allocating; INTER_AREA is faster and
+        # cleaner when shrinking camera frames, INTER_LINEAR when enlarging
+        input_w, input_h = self.input_size
+        if img_array.shape[0] * img_array.shape[1] > input_w * input_h:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
         
-        for detection in outputs:
-            # Extract confidence and class scores
-            confidence = detection[4]
-            if confidence < self.confidence_threshold:
-                continue
-            
-            # Get class with highest score
-            class_scores = detection[5:]
-            class_id = np.argmax(class_scores)
-            class_confidence = class_scores[class_id]
-            
-            # Final confidence
-            final_confidence = confidence * class_confidence
-            if final_confidence < self.confidence_threshold:
-                continue
-            
-            # Extract and scale bounding box
-            x_center, y_center, width, height = detection[:4]
-            
-            # Convert from center format to corner format
-            x1 = (x_center - width / 2) * scale_x
-            y1 = (y_center - height / 2) * scale_y
-            x2 = (x_center + width / 2) * scale_x
-            y2 = (y_center + height / 2) * scale_y
-            
-            # Normalize coordinates to [0, 1]
-            xmin = max(0, x1 / orig_w)
-            ymin = max(0, y1 / orig_h)
-            xmax = min(1, x2 / orig_w)
-            ymax = min(1, y2 / orig_h)
-            
-            # Skip invalid boxes
-            if xmax <= xmin or ymax <= ymin:
-                continue
-            
-            detections.append({
-                'label': self.class_names[class_id],
-                'score': float(final_confidence),
-                'xmin': float(xmin),
-                'ymin': float(ymin),
-                'xmax': float(xmax),
-                'ymax': float(ymax)
-            })
+        if self._uint8_input:
+            # The model does the channel swap, scaling and transpose itself
+            cv2.resize(img_array, self.input_size, dst=self._input_tensor[index], interpolation=interpolation)
+            return self._input_tensor[index]
         
-        # Apply NMS
-        detections = self._apply_nms(detections)
+        cv2.resize(img_array, self.input_size, dst=self._resized, interpolation=interpolation)
         
-        return detections
-
-    def _apply_nms(self, detections):
-        """Apply Non-Maximum Suppression to remove overlapping boxes"""
-        if not detections:
-            return detections
+        # BGR->RGB, HWC->CHW and [0, 1] scaling in one pass over the pixels
+        np.multiply(
+            self._resized.transpose(2, 0, 1)[::-1], 1 / 255.0,
+            out=self._input_tensor[index], dtype=self._input_tensor.dtype
+        )
         
-        # Sort by confidence
-        detections.sort(key=lambda x: x['score'], reverse=True)
+        return self._input_tensor[index]
+
+    def _postprocess_detections(self, outputs, original_shape):
+        """Post-process YOLO outputs to get bounding boxes"""
+        # YOLO output format: [batch, num_detections, 85] 
+        # 85 = 4 bbox coords + 1 confidence + 80 class scores
+        if len(outputs.shape) == 3:
+            outputs = outputs[0]  # Remove batch dimension
         
-        kept_detections = []
+        input_h, input_w = self.input_size[1], self.input_size[0]
         
-        while detections:
-            # Take the detection with highest confidence
-            best = detections.pop(0)
-            kept_detections.append(best)
-            
-            # Remove overlapping detections
-            detections = [
-                det for det in detections 
-                if self._calculate_iou(best, det) < self.nms_threshold
-            ]
+        # Drop low-objectness rows before touching the class scores
+        objectness = outputs[:, 4]
+        candidates = outputs[objectness >= self.confidence_threshold].astype(np.float32)
         
-        return kept_detections
-
-    def _calculate_iou(self, box1, box2):
-        """Calculate Intersection over Union (IoU) between two boxes"""
-        # Calculate intersection area
-        x1 = max(box1['xmin'], box2['xmin'])
-        y1 = max(box1['ymin'], box2['ymin'])
-        x2 = min(box1['xmax'], box2['xmax'])
-        y2 = min(box1['ymax'], box2['ymax'])
+        # Coordinates are normalized to [0, 1], so scaling to the original
+        # image and back cancels out to dividing by the model input size
+        corners, scores, class_ids = _decode_candidates(
+            candidates, self.confidence_threshold, 1.0 / input_w, 1.0 / input_h
+        )
         
-        if x2 <= x1 or y2 <= y1:
-            return 0.0
+        if len(scores) == 0:
+            return []
         
-        intersection = (x2 - x1) * (y2 - y1)
+        # Keep only the highest-scoring candidates so NMS cost stays bounded
+        if len(scores) > self.max_nms_candidates:
+            top = np.argpartition(-scores, self.max_nms_candidates)[:self.max_nms_candidates]
+            corners, scores, class_ids = corners[top], scores[top], class_ids[top]
         
-        # Calculate union area
-        area1 = (box1['xmax'] - box1['xmin']) * (box1['ymax'] - box1['ymin'])
-        area2 = (box2['xmax'] - box2['xmin']) * (box2['ymax'] - box2['ymin'])
-        union = area1 + area2 - intersection
+        # Apply NMS (runs in OpenCV's C++ implementation); NMSBoxes expects
+        # [x, y, width, height]
+        boxes = corners.copy()
+        boxes[:, 2:] -= boxes[:, :2]
+        keep = np.asarray(
+            cv2.dnn.NMSBoxes(boxes, scores, self.confidence_threshold, self.nms_threshold),
+            dtype=np.intp
+        ).reshape(-1)
         
-        return intersection / union if union > 0 else 0.0
+        # Only the surviving boxes are turned into detection dictionaries
+        return [
+            {
+                'label': self.class_names[class_id],
+                'score': score,
+                'xmin': xmin,
+                'ymin': ymin,
+                'xmax': xmax,
+                'ymax': ymax
+            }
+            for (xmin, ymin, xmax, ymax), score, class_id in zip(
+                corners[keep].tolist(), scores[keep].tolist(), class_ids[keep].tolist()
+            )
+        ]
 
     def get_model_info(self):
         """Get information about the loaded model"""
@@ -274,6 +544,18 @@ class InferenceEngine:
                 "model": "Loaded dynamically in browser"
             }
         
+        if self._process_pool is not None:
+            # The model lives in the worker processes; the parent has no session
+            return {
+                "mode": "server",
+                "inference_location": "worker-processes",
+                "processes": self.processes,
+                "status": "closed" if self._closed else "running",
+                "confidence_threshold": self.confidence_threshold,
+                "nms_threshold": self.nms_threshold,
+                "num_classes": len(self.class_names)
+            }
+        
         if self.session is None:
             return {"mode": "server", "status": "not_initialized"}
         
@@ -284,4 +566,26 @@ class InferenceEngine:
             "nms_threshold": self.nms_threshold,
             "num_classes": len(self.class_names),
             "providers": self.session.get_providers()
-        }
\ No newline at end of file
+        }
+
+    def close(self):
+        """Stop the batching worker and shut down the inference executors"""
+        if self._closed:
+            return
+        self._closed = True
+        
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+            self._batch_task = None
+        # Frames still waiting for a batch would otherwise never resolve
+        if self._batch_queue is not None:
+            while not self._batch_queue.empty():
+                _, future = self._batch_queue.get_nowait()
+                future.cancel()
+            self._batch_queue = None
+        
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True, cancel_futures=True)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        
+        logger.info("🛑 Inference engine closed")
@@ -7,6 +7,7 @@ Real-time multi-object detection with WebRTC streaming
 import sys
 from pathlib import Path
 import asyncio
+import functools
 import json
 import logging
 import os
@@ -14,12 +15,26 @@ import time
 from io import BytesIO
 import base64
 import socket
-import ssl
+import threading
+import weakref
 from dotenv import load_dotenv
 
 import aiohttp
 from aiohttp import web, WSMsgType
-import qrcode
+
+# orjson serializes several times faster than the stdlib; clients read text
+# frames, so its bytes are decoded back to str. Its parse errors subclass
+# json.JSONDecodeError, so either backend is handled the same way
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    json_dumps = json.dumps
+    json_loads = json.loads
 
 # Load environment variables from .env file
 load_dotenv()
@@ -31,6 +46,9 @@ from webrtc_handler import WebRTCHandler
 from inferencr_engine import InferenceEngine
 from metrics_collector import MetricsCollector
 
+STATIC_DIR = Path(__file__).resolve().parent.parent / 'static'
+MODELS_DIR = Path(__file__).resolve().parent.parent / 'models'
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG if os.getenv('DEBUG', 'false').lower() == 'true' else logging.INFO,
@@ -38,6 +56,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# PNG scratch buffer reused across renders, one per thread
+_png_buffers = threading.local()
+
+@functools.lru_cache(maxsize=32)
+def render_qr_png(data, border=4):
+    """Render a QR code PNG for `data`; cached since the image only depends on its inputs"""
+    buffer = getattr(_png_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = _png_buffers.buffer = BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    
+    # Imported on first render - the QR libraries are only needed on a cache miss.
+    # segno encodes and writes PNGs several times faster than qrcode + Pillow
+    try:
+        import segno
+    except ImportError:
+        segno = None
+    
+    if segno is not None:
+        # make_qr never picks a Micro QR symbol, which phone cameras may not read
+        segno.make_qr(data, error='m').save(buffer, kind='png', scale=10, border=border)
+    else:
+        import qrcode
+        qr = qrcode.QRCode(version=1, box_size=10, border=border)
+        qr.add_data(data)
+        qr.make(fit=True)
+        
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(buffer, format='PNG')
+    
+    return buffer.getvalue()
+
 class DetectionServer:
     def __init__(self):
         self.mode = os.getenv('MODE', 'wasm').lower()
@@ -45,6 +96,13 @@ class DetectionServer:
         self.port = 3000
         self.https_port = 3443  # HTTPS port
         self.ws_port = 8765
+        # REUSE_PORT=true lets several server processes share the ports (each has its
+        # own connections and metrics). Off by default so a second instance falls back
+        # to a free port instead; not available on Windows
+        self.reuse_port = (
+            os.getenv('REUSE_PORT', 'false').lower() == 'true' and hasattr(socket, 'SO_REUSEPORT')
+        )
+        self.metrics_push_interval = float(os.getenv('METRICS_PUSH_INTERVAL', '0'))  # seconds, 0 = off
         self.use_https = os.getenv('HTTPS', 'true').lower() == 'true'
         
         # Initialize components
@@ -53,7 +111,36 @@ class DetectionServer:
         self.metrics_collector = MetricsCollector()
         
         # Active connections
-        self.websockets = set()
+        # Weak so a connection missed by the cleanup below can't be kept alive by
+        # the connection set or its per-connection queues
+        self.websockets = weakref.WeakSet()
+        self.frame_queues = weakref.WeakKeyDictionary()  # ws -> single-slot queue holding its newest frame
+        self.send_queues = weakref.WeakKeyDictionary()  # ws -> bounded queue of outgoing messages
+        
+        # WebSocket message type -> handler
+        self.message_handlers = {
+            'offer': self.on_offer,
+            'ice-candidate': self.on_ice_candidate,
+            'ice-candidates': self.on_ice_candidates,
+            'frame': self.on_frame,
+            'metrics-request': self.on_metrics_request
+        }
+        
+        # Detection configuration for /api/config - the environment doesn't change
+        # while running, so the response body is serialized once
+        self.config_body = json_dumps({
+            'engine': os.getenv('DETECTION_ENGINE', 'gemini'),
+            'openrouter_api_key': os.getenv('OPENROUTER_API_KEY', ''),
+            'detection_interval': int(os.getenv('DETECTION_INTERVAL', '2000')),
+            'confidence_threshold': float(os.getenv('CONFIDENCE_THRESHOLD', '0.5')),
+            'max_detections': int(os.getenv('MAX_DETECTIONS', '8'))
+        }).encode()
+        
+        # Resolved once - looking it up opens a UDP socket
+        self.local_ip = self.get_local_ip()
+        
+        # Rendered /demo page as (url, html); re-rendered only when the URL changes
+        self._index_html = None
         
         logger.info(f"🚀 Initializing DetectionServer in {self.mode.upper()} mode")
         if self.use_https:
@@ -95,36 +182,24 @@ class DetectionServer:
 
     def generate_qr_code(self, url):
         """Generate QR code for phone access"""
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        return base64.b64encode(buffer.getvalue()).decode()
+        return base64.b64encode(render_qr_png(url, border=5)).decode()
 
     async def qr_handler(self, request):
         """Serve a QR PNG for the given `data` or `text` query param (same-origin)."""
         data = request.query.get('data') or request.query.get('text')
         if not data:
             # default to mobile page for better mobile experience
-            local_ip = self.get_local_ip()
+            local_ip = self.local_ip
             protocol = 'https' if self.use_https else 'http'
             port = self.https_port if self.use_https else self.port
             data = f"{protocol}://{local_ip}:{port}/mobile"
 
         try:
-            qr = qrcode.QRCode(version=1, box_size=10, border=4)
-            qr.add_data(data)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
-            buf = BytesIO()
-            img.save(buf, format='PNG')
-            buf.seek(0)
-            return web.Response(body=buf.getvalue(), content_type='image/png')
+            return web.Response(
+                body=render_qr_png(data),
+                content_type='image/png',
+                headers={'Cache-Control': 'public, max-age=86400'}
+            )
         except Exception as e:
             logger.error(f"QR generation error: {e}")
             return web.Response(status=500, text='QR generation failed')
@@ -137,11 +212,24 @@ class DetectionServer:
         self.websockets.add(ws)
         logger.info(f"📱 New WebSocket connection. Total: {len(self.websockets)}")
         
+        # Outgoing messages go through a sender task so a slow client never blocks
+        # inference or broadcasts
+        self.send_queues[ws] = asyncio.Queue(maxsize=8)
+        sender = asyncio.create_task(self.sender_loop(ws, self.send_queues[ws]))
+        
+        # In server mode frames are handed to a per-connection worker so a slow
+        # model skips frames instead of letting latency build up
+        frame_worker = None
+        if self.mode == 'server':
+            self.frame_queues[ws] = asyncio.Queue(maxsize=1)
+            frame_worker = asyncio.create_task(self.frame_worker(ws, self.frame_queues[ws]))
+        
         try:
             async for msg in ws:
-                if msg.type == WSMsgType.TEXT:
+                # Binary frames carry the same JSON as UTF-8 bytes, parsed without decoding to str
+                if msg.type in (WSMsgType.TEXT, WSMsgType.BINARY):
                     try:
-                        data = json.loads(msg.data)
+                        data = json_loads(msg.data)
                         await self.handle_websocket_message(ws, data)
                     except json.JSONDecodeError as e:
                         logger.error(f"Invalid JSON: {e}")
@@ -150,53 +238,121 @@ class DetectionServer:
         except Exception as e:
             logger.error(f"WebSocket handler error: {e}")
         finally:
+            if frame_worker is not None:
+                frame_worker.cancel()
+            sender.cancel()
+            self.frame_queues.pop(ws, None)
+            self.send_queues.pop(ws, None)
             self.websockets.discard(ws)
             logger.info(f"📱 WebSocket disconnected. Total: {len(self.websockets)}")
         
         return ws
 
+    def send(self, ws, payload):
+        """
+        Queue a detections/metrics message for `ws`, dropping its oldest pending
+        message when full. Signaling replies are sent directly instead
+        """
+        queue = self.send_queues.get(ws)
+        if queue is None:
+            return
+        if queue.full():
+            queue.get_nowait()
+            logger.debug("⏭️ Dropping oldest outgoing message for slow client")
+        queue.put_nowait(payload)
+
+    async def sender_loop(self, ws, queue):
+        """Write queued messages to one WebSocket connection"""
+        while True:
+            payload = await queue.get()
+            try:
+                await ws.send_str(payload)
+            except ConnectionError as e:
+                logger.debug(f"WebSocket send failed: {e}")
+                return
+
     async def handle_websocket_message(self, ws, data):
         """Process WebSocket messages"""
-        msg_type = data.get('type')
-        
-        if msg_type == 'offer':
-            # Handle WebRTC offer
-            answer = await self.webrtc_handler.handle_offer(data['sdp'])
-            await ws.send_str(json.dumps({
-                'type': 'answer',
-                'sdp': answer
-            }))
-            
-        elif msg_type == 'ice-candidate':
-            # Handle ICE candidate
-            await self.webrtc_handler.add_ice_candidate(data['candidate'])
-            
-        elif msg_type == 'frame':
-            # Handle video frame for inference
-            if self.mode == 'server':
-                await self.process_frame_server_mode(ws, data)
-            # In WASM mode, inference happens client-side
-            
-        elif msg_type == 'metrics-request':
-            # Send current metrics
-            metrics = self.metrics_collector.get_current_metrics()
-            await ws.send_str(json.dumps({
-                'type': 'metrics',
-                'data': metrics
-            }))
-
-    async def process_frame_server_mode(self, ws, frame_data):
+        handler = self.message_handlers.get(data.get('type'))
+        if handler is not None:
+            await handler(ws, data)
+
+    async def on_offer(self, ws, data):
+        """Handle WebRTC offer"""
+        answer = await self.webrtc_handler.handle_offer(data['sdp'])
+        # Signaling replies bypass the drop-oldest send queue - losing the answer
+        # would stall negotiation. aiohttp writes each frame whole, so this can't
+        # interleave with the sender task
+        await ws.send_str(json_dumps({
+            'type': 'answer',
+            'sdp': answer
+        }))
+
+    async def on_ice_candidate(self, ws, data):
+        """Handle ICE candidate"""
+        await self.webrtc_handler.add_ice_candidate(data['candidate'])
+
+    async def on_ice_candidates(self, ws, data):
+        """Handle a batch of ICE candidates"""
+        await self.webrtc_handler.add_ice_candidates(data['candidates'])
+
+    async def on_frame(self, ws, data):
+        """Handle video frame for inference"""
+        if self.mode == 'server':
+            queue = self.frame_queues[ws]
+            # Newest frame wins: replace a frame still waiting for inference
+            if queue.full():
+                stale = queue.get_nowait()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"⏭️ Skipping frame {stale[0].get('frame_id')}")
+            queue.put_nowait((data, time.time_ns() // 1_000_000))
+        # In WASM mode, inference happens client-side
+
+    async def on_metrics_request(self, ws, data):
+        """Send current metrics"""
+        metrics = self.metrics_collector.get_current_metrics()
+        self.send(ws, json_dumps({
+            'type': 'metrics',
+            'data': metrics
+        }))
+
+    async def broadcast_metrics(self):
+        """Push current metrics to every connected client, serialized once for all of them"""
+        if not self.websockets:
+            return
+        payload = json_dumps({
+            'type': 'metrics',
+            'data': self.metrics_collector.get_current_metrics()
+        })
+        for ws in self.websockets:
+            if not ws.closed:
+                self.send(ws, payload)
+
+    async def metrics_broadcaster(self, interval):
+        """Broadcast metrics every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.broadcast_metrics()
+
+    async def frame_worker(self, ws, queue):
+        """Run inference on the newest queued frame of one WebSocket connection"""
+        while True:
+            frame_data, recv_ts = await queue.get()
+            await self.process_frame_server_mode(ws, frame_data, recv_ts)
+
+    async def process_frame_server_mode(self, ws, frame_data, recv_ts=None):
         """Process frame in server mode with inference"""
         try:
             frame_id = frame_data.get('frame_id')
             capture_ts = frame_data.get('capture_ts')
             image_data = frame_data.get('image_data')  # Base64 encoded
             
-            recv_ts = int(time.time() * 1000)
+            if recv_ts is None:
+                recv_ts = time.time_ns() // 1_000_000
             
             # Run inference
             detections = await self.inference_engine.detect_objects(image_data)
-            inference_ts = int(time.time() * 1000)
+            inference_ts = time.time_ns() // 1_000_000
             
             # Prepare response
             response = {
@@ -209,7 +365,7 @@ class DetectionServer:
             }
             
             # Send back to client
-            await ws.send_str(json.dumps(response))
+            self.send(ws, json_dumps(response))
             
             # Record metrics
             self.metrics_collector.record_frame(
@@ -221,17 +377,32 @@ class DetectionServer:
 
     async def index_handler(self, request):
         """Serve the main page"""
-        # Generate QR code for current URL - use dynamic local IP
-        local_ip = self.get_local_ip()
+        # ?refresh=1 re-detects the local IP and re-renders the page
+        refresh = bool(request.query.get('refresh'))
+        if refresh:
+            self.local_ip = self.get_local_ip()
+        
+        # Generate QR code for current URL - use the resolved local IP
+        local_ip = self.local_ip
         
         # Use HTTPS if enabled, otherwise HTTP
         protocol = 'https' if self.use_https else 'http'
         port = self.https_port if self.use_https else self.port
         current_url = f"{protocol}://{local_ip}:{port}/demo"
         
+        # The page only depends on the URL, so render it once and reuse it
+        if self._index_html is None or self._index_html[0] != current_url or refresh:
+            self._index_html = (current_url, self._render_index_html(current_url))
+        
+        response = web.Response(text=self._index_html[1], content_type='text/html')
+        response.enable_compression()  # negotiated from Accept-Encoding
+        return response
+
+    def _render_index_html(self, current_url):
+        """Render the main page HTML with a QR code for `current_url`"""
         qr_code = self.generate_qr_code(current_url)
         
-        html_content = f"""
+        return f"""
 <!DOCTYPE html>
 <html>
 <head>
@@ -311,45 +482,19 @@ class DetectionServer:
 </body>
 </html>
 """
-        return web.Response(text=html_content, content_type='text/html')
-
-    async def static_handler(self, request):
-        """Serve static files"""
-        filename = request.match_info['filename']
-        static_dir = Path(__file__).parent.parent / 'static'
-        file_path = static_dir / filename
-        
-        if file_path.exists():
-            return web.FileResponse(file_path)
-        else:
-            return web.Response(status=404, text="File not found")
-
-    async def models_handler(self, request):
-        """Serve model files from the ./models directory"""
-        filename = request.match_info['filename']
-        models_dir = Path(__file__).parent.parent / 'models'
-        file_path = models_dir / filename
-
-        if file_path.exists():
-            return web.FileResponse(file_path)
-        else:
-            return web.Response(status=404, text="Model not found")
 
     async def ip_handler(self, request):
         """Return server's local IP address for mobile QR codes"""
-        local_ip = self.get_local_ip()
+        local_ip = self.local_ip
         return web.json_response({'ip': local_ip})
     
     async def config_handler(self, request):
         """Serve detection configuration from environment variables"""
-        config = {
-            'engine': os.getenv('DETECTION_ENGINE', 'gemini'),
-            'openrouter_api_key': os.getenv('OPENROUTER_API_KEY', ''),
-            'detection_interval': int(os.getenv('DETECTION_INTERVAL', '2000')),
-            'confidence_threshold': float(os.getenv('CONFIDENCE_THRESHOLD', '0.5')),
-            'max_detections': int(os.getenv('MAX_DETECTIONS', '8'))
-        }
-        return web.json_response(config)
+        return web.Response(
+            body=self.config_body,
+            content_type='application/json',
+            headers={'Cache-Control': 'private, max-age=300'}
+        )
     
     async def metrics_handler(self, request):
         """API endpoint for metrics"""
@@ -358,6 +503,8 @@ class DetectionServer:
 
     def create_ssl_context(self):
         """Create SSL context for HTTPS"""
+        import ssl
+        
         try:
             ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
             
@@ -393,6 +540,16 @@ class DetectionServer:
 
         app.middlewares.append(security_middleware)
 
+        # Static files, pages and models are revalidated against aiohttp's ETag (a
+        # cheap 304). Models are included because yolov5n.onnx is replaced in place
+        # when re-downloaded, so a long max-age would keep serving the old one.
+        # Runs at prepare time, once a FileResponse knows its final status
+        async def set_cache_headers(request, response):
+            if response.status == 200 and isinstance(response, web.FileResponse):
+                response.headers.setdefault('Cache-Control', 'no-cache')
+
+        app.on_response_prepare.append(set_cache_headers)
+
         # Routes
         app.router.add_get('/', self.root_handler)  # Serve main camera UI at root
         app.router.add_get('/landing', self.landing_handler)  # Landing page for protocol selection
@@ -401,8 +558,9 @@ class DetectionServer:
         app.router.add_get('/api/metrics', self.metrics_handler)
         app.router.add_get('/api/ip', self.ip_handler)  # Get server IP for mobile QR codes
         app.router.add_get('/api/config', self.config_handler)  # Get detection configuration from .env
-        app.router.add_get('/static/{filename}', self.static_handler)
-        app.router.add_get('/models/{filename}', self.models_handler)
+        # Served by aiohttp's static resource (sendfile, ETag, range requests)
+        app.router.add_static('/static', STATIC_DIR)
+        app.router.add_static('/models', MODELS_DIR)
         app.router.add_get('/qr', self.qr_handler)  # QR code generator endpoint
         app.router.add_get('/test', self.mobile_test_handler)  # Mobile test page
         app.router.add_get('/mobile', self.mobile_handler)  # Mobile optimized page
@@ -411,25 +569,25 @@ class DetectionServer:
 
     async def landing_handler(self, request):
         """Serve landing page to help users choose HTTP/HTTPS"""
-        static_dir = Path(__file__).parent.parent / 'static'
-        landing_file = static_dir / 'landing.html'
+        landing_file = STATIC_DIR / 'landing.html'
         
         if landing_file.exists():
             # Read the file and replace placeholders with actual IPs
             with open(landing_file, 'r', encoding='utf-8') as f:
                 content = f.read()
             
-            local_ip = self.get_local_ip()
+            local_ip = self.local_ip
             content = content.replace('172.20.19.211', local_ip)
             
-            return web.Response(text=content, content_type='text/html')
+            response = web.Response(text=content, content_type='text/html')
+            response.enable_compression()
+            return response
         else:
             return web.Response(status=404, text="Landing page not found")
 
     async def root_handler(self, request):
         """Serve the main camera UI (index.html) at the root path '/'"""
-        static_dir = Path(__file__).parent.parent / 'static'
-        index_file = static_dir / 'index.html'
+        index_file = STATIC_DIR / 'index.html'
 
         if index_file.exists():
             return web.FileResponse(index_file)
@@ -439,8 +597,7 @@ class DetectionServer:
 
     async def mobile_test_handler(self, request):
         """Serve mobile camera test page"""
-        static_dir = Path(__file__).parent.parent / 'static'
-        test_file = static_dir / 'mobile-camera-test.html'
+        test_file = STATIC_DIR / 'mobile-camera-test.html'
         
         if test_file.exists():
             return web.FileResponse(test_file)
@@ -449,8 +606,7 @@ class DetectionServer:
     
     async def mobile_handler(self, request):
         """Serve mobile optimized page"""
-        static_dir = Path(__file__).parent.parent / 'static'
-        mobile_file = static_dir / 'mobile.html'
+        mobile_file = STATIC_DIR / 'mobile.html'
         
         if mobile_file.exists():
             return web.FileResponse(mobile_file)
@@ -465,7 +621,7 @@ class DetectionServer:
         await runner.setup()
         # Start HTTP server (for fallback/development)
         try:
-            http_site = web.TCPSite(runner, self.host, self.port)
+            http_site = web.TCPSite(runner, self.host, self.port, reuse_port=self.reuse_port)
             await http_site.start()
             logger.info(f"🌐 HTTP Server running on http://{self.host}:{self.port}")
         except OSError as e:
@@ -475,7 +631,7 @@ class DetectionServer:
                 s.bind((self.host, 0))
                 free_port = s.getsockname()[1]
             self.port = free_port
-            http_site = web.TCPSite(runner, self.host, self.port)
+            http_site = web.TCPSite(runner, self.host, self.port, reuse_port=self.reuse_port)
             await http_site.start()
             logger.info(f"🌐 HTTP Server running on http://{self.host}:{self.port} (auto-selected)")
 
@@ -484,7 +640,7 @@ class DetectionServer:
             ssl_context = self.create_ssl_context()
             if ssl_context:
                 try:
-                    https_site = web.TCPSite(runner, self.host, self.https_port, ssl_context=ssl_context)
+                    https_site = web.TCPSite(runner, self.host, self.https_port, ssl_context=ssl_context, reuse_port=self.reuse_port)
                     await https_site.start()
                     logger.info(f"🔐 HTTPS Server running on https://{self.host}:{self.https_port}")
                 except OSError as e:
@@ -494,11 +650,11 @@ class DetectionServer:
                         s.bind((self.host, 0))
                         free_https = s.getsockname()[1]
                     self.https_port = free_https
-                    https_site = web.TCPSite(runner, self.host, self.https_port, ssl_context=ssl_context)
+                    https_site = web.TCPSite(runner, self.host, self.https_port, ssl_context=ssl_context, reuse_port=self.reuse_port)
                     await https_site.start()
                     logger.info(f"🔐 HTTPS Server running on https://{self.host}:{self.https_port} (auto-selected)")
                 
-                local_ip = self.get_local_ip()
+                local_ip = self.local_ip
                 logger.info(f"📱 Mobile URL (HTTPS): https://{local_ip}:{self.https_port}")
                 logger.info(f"� Desktop URL (HTTP): http://{local_ip}:{self.port}")
             else:
@@ -507,12 +663,19 @@ class DetectionServer:
         
         logger.info(f"📱 Mode: {self.mode.upper()}")
         
+        # Optionally push metrics to all clients instead of waiting for metrics-request
+        if self.metrics_push_interval > 0:
+            self._metrics_task = asyncio.create_task(self.metrics_broadcaster(self.metrics_push_interval))
+            logger.info(f"📊 Broadcasting metrics every {self.metrics_push_interval}s")
+        
         # Keep server running
         try:
             await asyncio.Future()  # Run forever
         except KeyboardInterrupt:
             logger.info("🛑 Shutting down server...")
             await runner.cleanup()
+        finally:
+            self.inference_engine.close()
 
 if __name__ == "__main__":
     server = DetectionServer()
@@ -525,6 +688,14 @@ if __name__ == "__main__":
             logger.info("💡 Run: wget https://github.com/ultralytics/yolov5/releases/download/v7.0/yolov5n.onnx -O models/yolov5n.onnx")
             exit(1)
     
+    # uvloop gives faster socket/WebSocket I/O; it is not available on Windows
+    try:
+        import uvloop
+        uvloop.install()
+        logger.info("⚡ Using uvloop event loop")
+    except ImportError:
+        pass
+    
     try:
         asyncio.run(server.run())
     except KeyboardInterrupt:
@@ -9,21 +9,41 @@ import time
 import threading
 from collections import deque
 from pathlib import Path
+import numpy as np
 import psutil
-import statistics
 
 logger = logging.getLogger(__name__)
 
+# orjson encodes the export in C, several times faster than the stdlib encoder
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+# Per-frame fields, stored column-wise in the frame ring buffer
+FRAME_FIELDS = ('timestamp', 'capture_ts', 'recv_ts', 'inference_ts', 'display_ts', 'num_detections')
+
 class MetricsCollector:
     def __init__(self, max_samples=1000):
         self.max_samples = max_samples
         self.start_time = time.time()
         
-        # Metrics storage
-        self.frame_metrics = deque(maxlen=max_samples)
+        # Metrics storage. Frames go into one preallocated int64 column per field,
+        # written as a ring buffer - no per-frame objects, and stats work on array views
+        self.frame_columns = {name: np.zeros(max_samples, dtype=np.int64) for name in FRAME_FIELDS}
+        # Monotonic record time (ms) per slot, used only to find recent frames:
+        # the wall-clock 'timestamp' column can step backwards on clock corrections
+        self._frame_monotonic = np.zeros(max_samples, dtype=np.int64)
+        self._frame_head = 0  # next slot to write
+        self._frame_count = 0  # filled slots
+        self._frame_generation = 0  # bumped on every write; keys the latency stats cache
+        self._latency_cache = None  # (generation, latency stats)
         self.system_metrics = deque(maxlen=100)  # Store last 100 system snapshots
         
-        # Counters
+        # Counters. record_frame is their only writer and runs on the event loop
+        # thread, so plain ints need no lock (the system monitor never touches them)
         self.total_frames = 0
         self.total_detections = 0
         self.frames_processed = 0
@@ -33,7 +53,7 @@ class MetricsCollector:
         self.initial_cpu_times = self.process.cpu_times()
         
         # Threading for periodic system metrics
-        self.system_monitor_active = True
+        self._stop_event = threading.Event()  # wakes the monitor out of its sleep on stop()
         self.system_monitor_thread = threading.Thread(target=self._monitor_system)
         self.system_monitor_thread.daemon = True
         self.system_monitor_thread.start()
@@ -42,62 +62,83 @@ class MetricsCollector:
 
     def record_frame(self, capture_ts, recv_ts, inference_ts, num_detections=0, display_ts=None):
         """Record metrics for a processed frame"""
-        current_ts = int(time.time() * 1000)
+        current_ts = time.time_ns() // 1_000_000
         if display_ts is None:
             display_ts = current_ts
         
-        # Calculate latencies
-        network_latency = recv_ts - capture_ts
-        server_latency = inference_ts - recv_ts
-        end_to_end_latency = display_ts - capture_ts
+        # Latencies are derived from the timestamps when read
+        head = self._frame_head
+        columns = self.frame_columns
+        columns['timestamp'][head] = current_ts
+        self._frame_monotonic[head] = time.monotonic_ns() // 1_000_000
+        columns['capture_ts'][head] = capture_ts
+        columns['recv_ts'][head] = recv_ts
+        columns['inference_ts'][head] = inference_ts
+        columns['display_ts'][head] = display_ts
+        columns['num_detections'][head] = num_detections
+        self._frame_head = (head + 1) % self.max_samples
+        self._frame_count = min(self._frame_count + 1, self.max_samples)
+        self._frame_generation += 1
         
-        frame_metric = {
-            'timestamp': current_ts,
-            'capture_ts': capture_ts,
-            'recv_ts': recv_ts,
-            'inference_ts': inference_ts,
-            'display_ts': display_ts,
-            'network_latency': network_latency,
-            'server_latency': server_latency,
-            'end_to_end_latency': end_to_end_latency,
-            'num_detections': num_detections
-        }
-        
-        self.frame_metrics.append(frame_metric)
         self.total_frames += 1
         self.total_detections += num_detections
         self.frames_processed += 1
         
-        logger.debug(f"📈 Frame {self.total_frames}: E2E={end_to_end_latency}ms, Objects={num_detections}")
+        # Skip building the message on every frame unless debug logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📈 Frame {self.total_frames}: E2E={display_ts - capture_ts}ms, Objects={num_detections}")
 
     def _monitor_system(self):
         """Background thread to monitor system metrics"""
-        while self.system_monitor_active:
+        # Non-blocking CPU percentages measure since the previous call (psutil keeps
+        # that state per thread), so prime them here; every sample then covers one sleep
+        self.process.cpu_percent()
+        psutil.cpu_percent(interval=None)
+        last_net = self._read_net_io()
+        
+        # Collect every 5 seconds; the CPU percentages cover this window
+        while not self._stop_event.wait(5):
             try:
-                # CPU and memory usage
-                cpu_percent = self.process.cpu_percent()
-                memory_info = self.process.memory_info()
-                system_cpu = psutil.cpu_percent(interval=1)
+                # CPU and memory usage, process probes read from procfs in one pass
+                with self.process.oneshot():
+                    process_info = self.process.as_dict(attrs=['cpu_percent', 'memory_info'])
+                cpu_percent = process_info['cpu_percent']
+                memory_info = process_info['memory_info']
+                system_cpu = psutil.cpu_percent(interval=None)
                 
-                # Network I/O (if available)
-                net_io = psutil.net_io_counters()
+                # Network I/O - bandwidth is computed once here rather than on every read
+                net = self._read_net_io()
+                timestamp, bytes_sent, bytes_recv = net
+                time_diff = (timestamp - last_net[0]) / 1000.0
+                uplink_kbps = ((bytes_sent - last_net[1]) * 8) / (time_diff * 1000) if time_diff > 0 else 0
+                downlink_kbps = ((bytes_recv - last_net[2]) * 8) / (time_diff * 1000) if time_diff > 0 else 0
+                last_net = net
                 
                 system_metric = {
-                    'timestamp': int(time.time() * 1000),
+                    'timestamp': timestamp,
                     'process_cpu_percent': cpu_percent,
                     'system_cpu_percent': system_cpu,
                     'memory_rss': memory_info.rss,
                     'memory_vms': memory_info.vms,
-                    'bytes_sent': net_io.bytes_sent if net_io else 0,
-                    'bytes_recv': net_io.bytes_recv if net_io else 0
+                    'bytes_sent': bytes_sent,
+                    'bytes_recv': bytes_recv,
+                    'uplink_kbps': uplink_kbps,
+                    'downlink_kbps': downlink_kbps
                 }
                 
                 self.system_metrics.append(system_metric)
                 
             except Exception as e:
                 logger.error(f"❌ Error collecting system metrics: {e}")
-            
-            time.sleep(5)  # Collect every 5 seconds
+
+    def _read_net_io(self):
+        """(timestamp ms, bytes sent, bytes received) for all interfaces"""
+        net_io = psutil.net_io_counters()  # None when there are no interfaces
+        return (
+            time.time_ns() // 1_000_000,
+            net_io.bytes_sent if net_io else 0,
+            net_io.bytes_recv if net_io else 0
+        )
 
     def get_current_metrics(self):
         """Get current performance metrics"""
@@ -113,154 +154,202 @@ class MetricsCollector:
             'avg_detections_per_frame': self.total_detections / self.total_frames if self.total_frames > 0 else 0
         }
         
-        # Latency statistics
-        if self.frame_metrics:
-            e2e_latencies = [m['end_to_end_latency'] for m in self.frame_metrics]
-            network_latencies = [m['network_latency'] for m in self.frame_metrics]
-            server_latencies = [m['server_latency'] for m in self.frame_metrics]
-            
-            metrics.update({
-                'latency': {
-                    'end_to_end': {
-                        'median': statistics.median(e2e_latencies),
-                        'p95': self._percentile(e2e_latencies, 95),
-                        'p99': self._percentile(e2e_latencies, 99),
-                        'mean': statistics.mean(e2e_latencies),
-                        'min': min(e2e_latencies),
-                        'max': max(e2e_latencies)
-                    },
-                    'network': {
-                        'median': statistics.median(network_latencies),
-                        'p95': self._percentile(network_latencies, 95),
-                        'mean': statistics.mean(network_latencies)
-                    },
-                    'server': {
-                        'median': statistics.median(server_latencies),
-                        'p95': self._percentile(server_latencies, 95),
-                        'mean': statistics.mean(server_latencies)
-                    }
-                }
-            })
+        # Latency statistics only change when a frame is recorded, so repeated
+        # polling reuses them
+        if self._frame_count:
+            if self._latency_cache is None or self._latency_cache[0] != self._frame_generation:
+                self._latency_cache = (self._frame_generation, self._latency_stats())
+            metrics['latency'] = self._latency_cache[1]
         
         # System metrics
         if self.system_metrics:
             latest_system = self.system_metrics[-1]
             
-            # Calculate bandwidth (rough estimate)
-            if len(self.system_metrics) >= 2:
-                prev_system = self.system_metrics[-2]
-                time_diff = (latest_system['timestamp'] - prev_system['timestamp']) / 1000.0
-                
-                bytes_sent_rate = (latest_system['bytes_sent'] - prev_system['bytes_sent']) / time_diff
-                bytes_recv_rate = (latest_system['bytes_recv'] - prev_system['bytes_recv']) / time_diff
-                
-                # Convert to kbps
-                uplink_kbps = (bytes_sent_rate * 8) / 1000
-                downlink_kbps = (bytes_recv_rate * 8) / 1000
-            else:
-                uplink_kbps = 0
-                downlink_kbps = 0
-            
             metrics.update({
                 'system': {
                     'process_cpu_percent': latest_system['process_cpu_percent'],
                     'system_cpu_percent': latest_system['system_cpu_percent'],
                     'memory_mb': latest_system['memory_rss'] / (1024 * 1024),
-                    'uplink_kbps': uplink_kbps,
-                    'downlink_kbps': downlink_kbps
+                    'uplink_kbps': latest_system['uplink_kbps'],
+                    'downlink_kbps': latest_system['downlink_kbps']
                 }
             })
         
         return metrics
 
+    def _latency_stats(self):
+        """Latency statistics over the frame window - all quantiles of each column in one pass"""
+        frames = self._frame_window()
+        latencies = np.stack((
+            frames['display_ts'] - frames['capture_ts'],  # end to end
+            frames['recv_ts'] - frames['capture_ts'],  # network
+            frames['inference_ts'] - frames['recv_ts']  # server
+        ), axis=1)
+        (e2e_median, network_median, server_median), \
+            (e2e_p95, network_p95, server_p95), \
+            (e2e_p99, _, _) = np.percentile(latencies, [50, 95, 99], axis=0).tolist()
+        e2e_mean, network_mean, server_mean = latencies.mean(axis=0).tolist()
+        
+        return {
+            'end_to_end': {
+                'median': e2e_median,
+                'p95': e2e_p95,
+                'p99': e2e_p99,
+                'mean': e2e_mean,
+                'min': latencies[:, 0].min().item(),
+                'max': latencies[:, 0].max().item()
+            },
+            'network': {
+                'median': network_median,
+                'p95': network_p95,
+                'mean': network_mean
+            },
+            'server': {
+                'median': server_median,
+                'p95': server_p95,
+                'mean': server_mean
+            }
+        }
+
+    def _frame_window(self, ordered=False):
+        """
+        Column views of the recorded frames
+        Args:
+            ordered: Return frames oldest first (copies the columns once the ring has wrapped)
+        """
+        count = self._frame_count
+        if count < self.max_samples:
+            return {name: column[:count] for name, column in self.frame_columns.items()}
+        if not ordered or self._frame_head == 0:
+            return self.frame_columns
+        # Full ring: the oldest frame sits at the write head
+        head = self._frame_head
+        return {
+            name: np.concatenate((column[head:], column[:head]))
+            for name, column in self.frame_columns.items()
+        }
+
+    def _recent_slices(self, cutoff_time):
+        """
+        Ring buffer slices holding the frames recorded at or after cutoff_time
+        (monotonic ms). Monotonic record times never decrease in write order, so
+        each contiguous run of the ring is binary searched instead of scanning
+        every frame
+        """
+        head, count = self._frame_head, self._frame_count
+        # Contiguous runs, oldest first
+        runs = [(0, count)] if count < self.max_samples else [(head, count), (0, head)]
+        timestamps = self._frame_monotonic
+        
+        slices = []
+        for start, end in runs:
+            start += int(np.searchsorted(timestamps[start:end], cutoff_time))
+            if start < end:
+                slices.append(slice(start, end))
+        return slices
+
+    def _frame_dicts(self, frames):
+        """Materialize frame columns as per-frame dicts (export only)"""
+        rows = zip(*(frames[name].tolist() for name in FRAME_FIELDS))
+        frame_data = []
+        for timestamp, capture_ts, recv_ts, inference_ts, display_ts, num_detections in rows:
+            frame_data.append({
+                'timestamp': timestamp,
+                'capture_ts': capture_ts,
+                'recv_ts': recv_ts,
+                'inference_ts': inference_ts,
+                'display_ts': display_ts,
+                'network_latency': recv_ts - capture_ts,
+                'server_latency': inference_ts - recv_ts,
+                'end_to_end_latency': display_ts - capture_ts,
+                'num_detections': num_detections
+            })
+        return frame_data
+
     def _percentile(self, data, p):
-        """Calculate percentile of data"""
-        if not data:
+        """Calculate percentile of data (linear interpolation between closest ranks)"""
+        if len(data) == 0:
             return 0
-        sorted_data = sorted(data)
-        index = (p / 100.0) * (len(sorted_data) - 1)
-        if index.is_integer():
-            return sorted_data[int(index)]
-        else:
-            lower = sorted_data[int(index)]
-            upper = sorted_data[int(index) + 1]
-            return lower + (upper - lower) * (index - int(index))
+        return np.percentile(data, p).item()
 
     def export_metrics(self, filename="metrics.json", duration_filter=None):
         """Export metrics to JSON file"""
         metrics = self.get_current_metrics()
         
         # Add raw frame data if requested
-        frame_data = []
-        for frame in self.frame_metrics:
-            if duration_filter is None or frame['timestamp'] >= duration_filter:
-                frame_data.append(frame)
+        frames = self._frame_window(ordered=True)
+        if duration_filter is not None:
+            keep = frames['timestamp'] >= duration_filter
+            frames = {name: column[keep] for name, column in frames.items()}
         
         export_data = {
             'summary': metrics,
-            'export_timestamp': int(time.time() * 1000),
-            'frame_count': len(frame_data),
-            'frames': frame_data[-100:] if len(frame_data) > 100 else frame_data  # Last 100 frames
+            'export_timestamp': time.time_ns() // 1_000_000,
+            'frame_count': len(frames['timestamp']),
+            'frames': self._frame_dicts({name: column[-100:] for name, column in frames.items()})  # Last 100 frames
         }
         
         # Save to file
         output_path = Path("metrics") / filename
         output_path.parent.mkdir(exist_ok=True)
         
-        with open(output_path, 'w') as f:
-            json.dump(export_data, f, indent=2)
+        if ORJSON_AVAILABLE:
+            output_path.write_bytes(
+                orjson.dumps(export_data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+            )
+        else:
+            with open(output_path, 'w') as f:
+                json.dump(export_data, f, indent=2)
         
         logger.info(f"📊 Metrics exported to {output_path}")
         return output_path
 
     def get_benchmark_summary(self, duration_seconds=30):
         """Get a benchmark summary for the specified duration"""
-        if not self.frame_metrics:
+        if not self._frame_count:
             return {"error": "No metrics available"}
         
         # Filter frames from the last duration_seconds
-        cutoff_time = int(time.time() * 1000) - (duration_seconds * 1000)
-        recent_frames = [f for f in self.frame_metrics if f['timestamp'] >= cutoff_time]
+        cutoff_time = time.monotonic_ns() // 1_000_000 - (duration_seconds * 1000)
+        recent = self._recent_slices(cutoff_time)
+        frames_processed = sum(part.stop - part.start for part in recent)
         
-        if not recent_frames:
+        if not frames_processed:
             return {"error": f"No metrics in last {duration_seconds} seconds"}
         
         # Calculate key metrics
-        e2e_latencies = [f['end_to_end_latency'] for f in recent_frames]
-        total_detections = sum(f['num_detections'] for f in recent_frames)
+        columns = self.frame_columns
+        e2e_latencies = np.concatenate([
+            columns['display_ts'][part] - columns['capture_ts'][part] for part in recent
+        ])
+        total_detections = sum(int(columns['num_detections'][part].sum()) for part in recent)
         
-        fps = len(recent_frames) / duration_seconds
+        fps = frames_processed / duration_seconds
         
         summary = {
             'duration_seconds': duration_seconds,
-            'frames_processed': len(recent_frames),
+            'frames_processed': frames_processed,
             'processed_fps': fps,
             'total_detections': total_detections,
-            'median_e2e_latency_ms': statistics.median(e2e_latencies),
+            'median_e2e_latency_ms': self._percentile(e2e_latencies, 50),
             'p95_e2e_latency_ms': self._percentile(e2e_latencies, 95),
-            'mean_e2e_latency_ms': statistics.mean(e2e_latencies)
+            'mean_e2e_latency_ms': e2e_latencies.mean().item()
         }
         
         # Add bandwidth if available
         if self.system_metrics:
             latest = self.system_metrics[-1]
-            if len(self.system_metrics) >= 2:
-                prev = self.system_metrics[-2]
-                time_diff = (latest['timestamp'] - prev['timestamp']) / 1000.0
-                
-                uplink_kbps = ((latest['bytes_sent'] - prev['bytes_sent']) * 8) / (time_diff * 1000)
-                downlink_kbps = ((latest['bytes_recv'] - prev['bytes_recv']) * 8) / (time_diff * 1000)
-                
-                summary.update({
-                    'uplink_kbps': uplink_kbps,
-                    'downlink_kbps': downlink_kbps
-                })
+            summary.update({
+                'uplink_kbps': latest['uplink_kbps'],
+                'downlink_kbps': latest['downlink_kbps']
+            })
         
         return summary
 
     def reset_metrics(self):
         """Reset all metrics counters"""
-        self.frame_metrics.clear()
+        self._frame_head = 0
+        self._frame_count = 0
         self.system_metrics.clear()
         self.total_frames = 0
         self.total_detections = 0
@@ -271,7 +360,7 @@ class MetricsCollector:
 
     def stop(self):
         """Stop the metrics collector"""
-        self.system_monitor_active = False
+        self._stop_event.set()
         if self.system_monitor_thread.is_alive():
             self.system_monitor_thread.join(timeout=2)
         
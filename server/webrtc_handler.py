@@ -4,14 +4,25 @@ Handles peer connections, SDP negotiation, and media streams
 """
 
 import asyncio
+import concurrent.futures
+import functools
 import logging
 from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
 from aiortc.contrib.media import MediaStreamTrack
+from aiortc.sdp import candidate_from_sdp
 import av
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
+class ClientState:
+    """Per-client peer connection and its video track, kept in one entry"""
+    __slots__ = ('pc', 'track')
+
+    def __init__(self, pc, track=None):
+        self.pc = pc
+        self.track = track
+
 class WebRTCHandler:
     def __init__(self):
         # STUN servers for NAT traversal
@@ -21,20 +32,24 @@ class WebRTCHandler:
         ]
         
         self.config = RTCConfiguration(iceServers=self.ice_servers)
-        self.peer_connections = {}
-        self.video_tracks = {}
+        self.clients = {}  # client_id -> ClientState
+        
+        # YUV -> RGB conversion (libswscale) runs here instead of on the event loop
+        self._convert_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="frame-convert"
+        )
         
         logger.info("🔗 WebRTC Handler initialized")
 
     async def handle_offer(self, sdp_offer, client_id=None):
         """Handle WebRTC offer and create answer"""
         if client_id is None:
-            client_id = f"client_{len(self.peer_connections)}"
+            client_id = f"client_{len(self.clients)}"
         
         try:
             # Create peer connection
             pc = RTCPeerConnection(configuration=self.config)
-            self.peer_connections[client_id] = pc
+            client = self.clients[client_id] = ClientState(pc)
             
             # Set up event handlers
             @pc.on("connectionstatechange")
@@ -47,7 +62,7 @@ class WebRTCHandler:
             async def on_track(track):
                 logger.info(f"📹 Received track: {track.kind}")
                 if track.kind == "video":
-                    self.video_tracks[client_id] = track
+                    client.track = track
                     logger.info(f"✅ Video track registered for {client_id}")
 
             # Set remote description (offer)
@@ -65,100 +80,183 @@ class WebRTCHandler:
             logger.error(f"❌ Error handling offer: {e}")
             raise
 
-    async def add_ice_candidate(self, candidate_data, client_id=None):
-        """Add ICE candidate to peer connection"""
-        if client_id is None and self.peer_connections:
-            client_id = list(self.peer_connections.keys())[0]
+    def _resolve_client(self, client_id):
+        """Default to the first peer connection when no client_id is given"""
+        if client_id is None and self.clients:
+            client_id = next(iter(self.clients))
         
-        if client_id not in self.peer_connections:
+        if client_id not in self.clients:
             logger.warning(f"⚠️ No peer connection found for {client_id}")
+            return None
+        return client_id
+
+    def _parse_ice_candidate(self, candidate_data):
+        """Build an RTCIceCandidate from browser candidate data, or None to skip it"""
+        if not isinstance(candidate_data, dict):
+            return candidate_data
+        
+        # Check if candidate is not empty
+        candidate_str = candidate_data.get('candidate', '')
+        if not candidate_str:
+            logger.debug("Skipping empty ICE candidate")
+            return None
+        
+        # Use aiortc's method to parse ICE candidate from SDP string
+        try:
+            candidate = candidate_from_sdp(candidate_str)
+            candidate.sdpMid = candidate_data.get('sdpMid')
+            candidate.sdpMLineIndex = candidate_data.get('sdpMLineIndex')
+            return candidate
+        except Exception as parse_error:
+            logger.warning(f"Could not parse ICE candidate: {parse_error}")
+            return None
+
+    async def add_ice_candidate(self, candidate_data, client_id=None):
+        """Add ICE candidate to peer connection"""
+        client_id = self._resolve_client(client_id)
+        if client_id is None:
             return
         
         try:
-            pc = self.peer_connections[client_id]
+            pc = self.clients[client_id].pc
             
-            # Handle ICE candidate data
-            if isinstance(candidate_data, dict):
-                # Check if candidate is not empty
-                candidate_str = candidate_data.get('candidate', '')
-                if not candidate_str:
-                    logger.debug("Skipping empty ICE candidate")
-                    return
-                
-                # Use aiortc's method to parse ICE candidate from SDP string
-                from aiortc.sdp import candidate_from_sdp
-                try:
-                    candidate = candidate_from_sdp(candidate_str)
-                    candidate.sdpMid = candidate_data.get('sdpMid')
-                    candidate.sdpMLineIndex = candidate_data.get('sdpMLineIndex')
-                except Exception as parse_error:
-                    logger.warning(f"Could not parse ICE candidate: {parse_error}")
-                    return
-            else:
-                candidate = candidate_data
+            candidate = self._parse_ice_candidate(candidate_data)
+            if candidate is None:
+                return
             
             await pc.addIceCandidate(candidate)
-            logger.debug(f"🧊 Added ICE candidate for {client_id}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"🧊 Added ICE candidate for {client_id}")
         except Exception as e:
             logger.error(f"❌ Error adding ICE candidate: {e}")
-            logger.debug(f"Candidate data: {candidate_data}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Candidate data: {candidate_data}")
+
+    async def add_ice_candidates(self, candidates_data, client_id=None):
+        """Add a batch of trickled ICE candidates with a single gather"""
+        client_id = self._resolve_client(client_id)
+        if client_id is None:
+            return
+        
+        pc = self.clients[client_id].pc
+        candidates = [self._parse_ice_candidate(data) for data in candidates_data]
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        
+        results = await asyncio.gather(
+            *(pc.addIceCandidate(candidate) for candidate in candidates),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"❌ Error adding ICE candidate: {result}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"🧊 Added {len(candidates)} ICE candidates for {client_id}")
+
+    def _video_track(self, client_id):
+        """Video track of client_id, or of the first client that has one"""
+        if client_id is None:
+            client_id = next((cid for cid, client in self.clients.items() if client.track is not None), None)
+        
+        client = self.clients.get(client_id)
+        return client.track if client is not None else None
 
     async def get_video_frame(self, client_id=None):
         """Get latest video frame from client"""
-        if client_id is None and self.video_tracks:
-            client_id = list(self.video_tracks.keys())[0]
-        
-        if client_id not in self.video_tracks:
+        track = self._video_track(client_id)
+        if track is None:
             return None
         
         try:
-            track = self.video_tracks[client_id]
             frame = await track.recv()
             
-            # Convert to numpy array
-            img = frame.to_ndarray(format="rgb24")
+            # Convert to numpy array off the event loop
+            loop = asyncio.get_running_loop()
+            img = await loop.run_in_executor(
+                self._convert_pool, functools.partial(frame.to_ndarray, format="rgb24")
+            )
             return img
             
         except Exception as e:
             logger.error(f"❌ Error getting video frame: {e}")
             return None
 
+    async def get_video_frames(self, max_frames, client_id=None, frame_timeout=0.001):
+        """
+        Get up to max_frames already-received frames as one RGB batch
+        Args:
+            max_frames: Batch size limit
+            frame_timeout: How long to wait for each frame after the first
+        Returns:
+            uint8 array [N, height, width, 3], or None
+        """
+        track = self._video_track(client_id)
+        if track is None:
+            return None
+        
+        try:
+            # Wait for one frame, then take whatever else arrives right behind it
+            frames = [await track.recv()]
+            while len(frames) < max_frames:
+                try:
+                    frame = await asyncio.wait_for(track.recv(), frame_timeout)
+                except asyncio.TimeoutError:
+                    break
+                # A resolution change ends the batch; for live video dropping
+                # that one frame is cheaper than holding it back
+                if (frame.width, frame.height) != (frames[0].width, frames[0].height):
+                    break
+                frames.append(frame)
+            
+            # Convert the whole batch in one executor call, into a single allocation
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._convert_pool, self._frames_to_batch, frames)
+            
+        except Exception as e:
+            logger.error(f"❌ Error getting video frames: {e}")
+            return None
+
+    @staticmethod
+    def _frames_to_batch(frames):
+        """Convert same-sized frames into one [N, height, width, 3] RGB array"""
+        batch = np.empty((len(frames), frames[0].height, frames[0].width, 3), dtype=np.uint8)
+        for index, frame in enumerate(frames):
+            batch[index] = frame.to_ndarray(format="rgb24")
+        return batch
+
     async def cleanup_peer_connection(self, client_id):
         """Clean up peer connection and related resources"""
         try:
-            if client_id in self.peer_connections:
-                pc = self.peer_connections[client_id]
-                await pc.close()
-                del self.peer_connections[client_id]
+            # Removed before closing: close() fires connectionstatechange, which
+            # calls back in here
+            client = self.clients.pop(client_id, None)
+            if client is not None:
+                await client.pc.close()
                 logger.info(f"🧹 Cleaned up peer connection for {client_id}")
             
-            if client_id in self.video_tracks:
-                del self.video_tracks[client_id]
-                logger.info(f"🧹 Cleaned up video track for {client_id}")
-                
         except Exception as e:
             logger.error(f"❌ Error cleaning up peer connection: {e}")
 
     async def close_all_connections(self):
         """Close all peer connections"""
-        for client_id in list(self.peer_connections.keys()):
-            await self.cleanup_peer_connection(client_id)
+        # cleanup_peer_connection removes each entry before awaiting the close
+        while self.clients:
+            await self.cleanup_peer_connection(next(iter(self.clients)))
         
         logger.info("🛑 All peer connections closed")
 
     def get_connection_stats(self):
         """Get statistics for all connections"""
         stats = {
-            "total_connections": len(self.peer_connections),
-            "active_video_tracks": len(self.video_tracks),
+            "total_connections": len(self.clients),
+            "active_video_tracks": sum(client.track is not None for client in self.clients.values()),
             "connections": {}
         }
         
-        for client_id, pc in self.peer_connections.items():
+        for client_id, client in self.clients.items():
             stats["connections"][client_id] = {
-                "state": pc.connectionState,
-                "ice_connection_state": pc.iceConnectionState,
-                "ice_gathering_state": pc.iceGatheringState
+                "state": client.pc.connectionState,
+                "ice_connection_state": client.pc.iceConnectionState,
+                "ice_gathering_state": client.pc.iceGatheringState
             }
         
         return stats
\ No newline at end of file